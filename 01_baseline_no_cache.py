@@ -6,117 +6,65 @@ cost + latency so we have something to compare against.
     python 01_baseline_no_cache.py
 """
 
-import boto3
+import argparse
 import json
-import time
 from pathlib import Path
 
-bedrock = boto3.client("bedrock-runtime", region_name="us-east-1")
+from common import (
+    BASELINE_SYSTEM,
+    QUESTIONS,
+    SYSTEM_WORDS,
+    cost_breakdown,
+    get_client,
+    iter_turns,
+    sum_turns,
+    summary_cost,
+    tokens_per_second,
+)
+
+bedrock = get_client()
 
 # Model to benchmark — change this to test different models
 # Nova Pro (works out of the box, no use case form needed)
 MODEL_ID = "amazon.nova-pro-v1:0"
 
 
-SYSTEM_PROMPT = """You are a senior customer support agent for SmartWidget, a SaaS company.
-
-Rules:
-- Always be polite, professional, and concise
-- Reference the product documentation when answering
-- If the answer is not in the documentation, say so honestly
-- Format responses with bullet points for clarity
-- Never make up product features or pricing that isn't documented
-- Keep responses under 150 words unless the question requires more detail
-"""
-
-# Load product docs (~3000 tokens)
-PRODUCT_DOCS = Path(__file__).parent.joinpath("product_docs.txt").read_text()
-
-# Combine into full system content
-FULL_SYSTEM = SYSTEM_PROMPT + "\n\n--- PRODUCT DOCUMENTATION ---\n\n" + PRODUCT_DOCS
-
-# Realistic multi-turn customer support questions
-QUESTIONS = [
-    "What are the main features of SmartWidget Pro?",
-    "How do I configure the API integration? Give me a quick start guide.",
-    "What's the pricing for enterprise customers?",
-    "My API is returning 429 errors. How do I fix this?",
-    "How do I migrate from v3.x to v4.2? What are the breaking changes?",
-]
-
-
-def ask_question_baseline(question, conversation_history=None):
-    """Send a question WITHOUT prompt caching."""
-    if conversation_history is None:
-        conversation_history = []
-
-    messages = conversation_history + [
-        {"role": "user", "content": [{"text": question}]}
-    ]
-
-    start_time = time.time()
-
-    response = bedrock.converse(
-        modelId=MODEL_ID,
-        system=[{"text": FULL_SYSTEM}],
-        messages=messages,
-        inferenceConfig={"maxTokens": 512, "temperature": 0.1},
-    )
-
-    elapsed = time.time() - start_time
-    usage = response["usage"]
-
-    return {
-        "response": response,
-        "text": response["output"]["message"]["content"][0]["text"],
-        "latency_s": elapsed,
-        "input_tokens": usage["inputTokens"],
-        "output_tokens": usage["outputTokens"],
-    }
-
-
-def run_baseline():
+def run_baseline(use_response_cache=True):
     print("=" * 70)
     print(f"BASELINE BENCHMARK — No Caching")
     print(f"Model: {MODEL_ID}")
-    print(f"System prompt + docs: ~{len(FULL_SYSTEM.split())} words")
+    print(f"System prompt + docs: ~{SYSTEM_WORDS} words")
     print("=" * 70)
 
-    total_input_tokens = 0
-    total_output_tokens = 0
-    total_latency = 0.0
-    history = []
     turn_results = []
 
-    for i, question in enumerate(QUESTIONS):
-        print(f"\n--- Turn {i + 1}/{len(QUESTIONS)} ---")
-        print(f"Q: {question}")
-
-        result = ask_question_baseline(question, history)
-
-        print(f"A: {result['text'][:120]}...")
-        print(f"  Latency:       {result['latency_s']:.2f}s")
-        print(f"  Input tokens:  {result['input_tokens']}")
-        print(f"  Output tokens: {result['output_tokens']}")
-
-        total_input_tokens += result["input_tokens"]
-        total_output_tokens += result["output_tokens"]
-        total_latency += result["latency_s"]
-
-        turn_results.append({
-            "turn": i + 1,
-            "question": question,
-            "latency_s": result["latency_s"],
-            "input_tokens": result["input_tokens"],
-            "output_tokens": result["output_tokens"],
-        })
-
-        # Add to conversation history for multi-turn
-        history.append({"role": "user", "content": [{"text": question}]})
-        history.append({
-            "role": "assistant",
-            "content": result["response"]["output"]["message"]["content"],
-        })
+    for turn in iter_turns(
+        bedrock, MODEL_ID, QUESTIONS, BASELINE_SYSTEM, use_response_cache=use_response_cache
+    ):
+        print(f"\n--- Turn {turn['turn']}/{len(QUESTIONS)} ---")
+        print(f"Q: {turn['question']}")
+        print(f"A: {turn['text'][:120]}...")
+        if turn["replayed"]:
+            print("  (replayed from the local response cache)")
+        print(f"  TTFT:          {turn['ttft_s']:.2f}s")
+        print(f"  Decode:        {turn['decode_s']:.2f}s ({turn['tokens_per_s']:.0f} tok/s)")
+        print(f"  Latency:       {turn['latency_s']:.2f}s")
+        if turn["summary_input_tokens"]:
+            print(f"  + summary:     {turn['summary_latency_s']:.2f}s "
+                  f"({turn['summary_input_tokens']} in / {turn['summary_output_tokens']} out, Nova Micro)")
+        print(f"  Input tokens:  {turn['input_tokens']}")
+        print(f"  Output tokens: {turn['output_tokens']}")
+
+        turn_results.append({k: v for k, v in turn.items() if k != "text"})
+
+    totals = sum_turns(turn_results)
+    total_input_tokens = totals["input_tokens"]
+    total_output_tokens = totals["output_tokens"]
+    total_ttft = totals["ttft_s"]
+    total_decode = totals["decode_s"]
+    # Turns wait on the rolling-window summary call made before them
+    total_summary_latency = totals["summary_latency_s"]
+    total_latency = totals["latency_s"] + total_summary_latency
 
     # Summary
     print("\n" + "=" * 70)
@@ -125,26 +73,24 @@ def run_baseline():
     print(f"Total turns:         {len(QUESTIONS)}")
     print(f"Total input tokens:  {total_input_tokens}")
     print(f"Total output tokens: {total_output_tokens}")
+    print(f"Total TTFT:          {total_ttft:.2f}s")
+    print(f"Avg TTFT/turn:       {total_ttft / len(QUESTIONS):.2f}s")
+    print(f"Total decode:        {total_decode:.2f}s ({tokens_per_second(total_output_tokens, total_decode):.0f} tok/s)")
     print(f"Total latency:       {total_latency:.2f}s")
+    print(f"  incl. summary:     {total_summary_latency:.2f}s "
+          f"({totals['summary_input_tokens']} in / {totals['summary_output_tokens']} out tokens)")
     print(f"Avg latency/turn:    {total_latency / len(QUESTIONS):.2f}s")
     print(f"Avg input tokens/turn: {total_input_tokens // len(QUESTIONS)}")
 
-    # Cost estimate — pricing varies by model
-    # Nova Pro: $0.80/1M input, $3.20/1M output
-    # Verify at https://aws.amazon.com/bedrock/pricing/
-    PRICING = {
-        "amazon.nova-pro-v1:0": (0.80, 3.20),
-        "amazon.nova-lite-v1:0": (0.06, 0.24),
-        "amazon.nova-micro-v1:0": (0.035, 0.14),
-    }
-    input_price, output_price = PRICING.get(MODEL_ID, (3.0, 15.0))
-    input_cost = (total_input_tokens / 1_000_000) * input_price
-    output_cost = (total_output_tokens / 1_000_000) * output_price
-    total_cost = input_cost + output_cost
+    # Cost estimate — pricing varies by model, see common.PRICING
+    costs = cost_breakdown(MODEL_ID, total_input_tokens, total_output_tokens)
+    total_summary_cost = summary_cost(totals)
+    total_cost = costs["total"] + total_summary_cost
 
     print(f"\n--- Cost Estimate (this session) ---")
-    print(f"Input cost:   ${input_cost:.6f}")
-    print(f"Output cost:  ${output_cost:.6f}")
+    print(f"Input cost:   ${costs['input']:.6f}")
+    print(f"Output cost:  ${costs['output']:.6f}")
+    print(f"Summary cost: ${total_summary_cost:.6f} (Nova Micro)")
     print(f"Total cost:   ${total_cost:.6f}")
 
     # Projection: 1,000 conversations/day × 5 turns
@@ -166,13 +112,17 @@ def run_baseline():
         "totals": {
             "input_tokens": total_input_tokens,
             "output_tokens": total_output_tokens,
-            "latency_s": round(total_latency, 2),
-            "cost_usd": round(total_cost, 6),
+            "ttft_s": total_ttft,
+            "decode_s": total_decode,
+            "latency_s": total_latency,
+            "summary_latency_s": total_summary_latency,
+            "summary_cost_usd": total_summary_cost,
+            "cost_usd": total_cost,
         },
         "daily_projection": {
             "conversations": 1000,
-            "daily_cost_usd": round(daily_cost, 2),
-            "monthly_cost_usd": round(daily_cost * 30, 2),
+            "daily_cost_usd": daily_cost,
+            "monthly_cost_usd": daily_cost * 30,
         },
     }
 
@@ -183,4 +133,11 @@ def run_baseline():
 
 
 if __name__ == "__main__":
-    run_baseline()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always call Bedrock instead of replaying stored responses",
+    )
+    args = parser.parse_args()
+    run_baseline(use_response_cache=not args.no_cache)
@@ -1,136 +1,75 @@
 # Same workload as 01_baseline, but with a cachePoint added to the system block.
 # Compare the output side-by-side to see cache hits kicking in from Turn 2 onwards.
 
-import boto3
+import argparse
 import json
-import time
 from pathlib import Path
 
-bedrock = boto3.client("bedrock-runtime", region_name="us-east-1")
+from common import (
+    CACHED_SYSTEM,
+    QUESTIONS,
+    SYSTEM_WORDS,
+    cost_breakdown,
+    get_client,
+    iter_turns,
+    pricing_for,
+    sum_turns,
+    summary_cost,
+    tokens_per_second,
+)
+
+bedrock = get_client()
 
 # Model to benchmark
 MODEL_ID = "amazon.nova-pro-v1:0"
 
 
-SYSTEM_PROMPT = """You are a senior customer support agent for SmartWidget, a SaaS company.
-
-Rules:
-- Always be polite, professional, and concise
-- Reference the product documentation when answering
-- If the answer is not in the documentation, say so honestly
-- Format responses with bullet points for clarity
-- Never make up product features or pricing that isn't documented
-- Keep responses under 150 words unless the question requires more detail
-"""
-
-# Load product docs (~3000 tokens)
-PRODUCT_DOCS = Path(__file__).parent.joinpath("product_docs.txt").read_text()
-
-# Combine into full system content
-FULL_SYSTEM = SYSTEM_PROMPT + "\n\n--- PRODUCT DOCUMENTATION ---\n\n" + PRODUCT_DOCS
-
-# Same questions as baseline for fair comparison
-QUESTIONS = [
-    "What are the main features of SmartWidget Pro?",
-    "How do I configure the API integration? Give me a quick start guide.",
-    "What's the pricing for enterprise customers?",
-    "My API is returning 429 errors. How do I fix this?",
-    "How do I migrate from v3.x to v4.2? What are the breaking changes?",
-]
-
-
-def ask_question_cached(question, conversation_history=None):
-    """Send a question WITH prompt caching enabled."""
-    if conversation_history is None:
-        conversation_history = []
-
-    messages = conversation_history + [
-        {"role": "user", "content": [{"text": question}]}
-    ]
-
-    start_time = time.time()
-
-    response = bedrock.converse(
-        modelId=MODEL_ID,
-        system=[
-            {"text": FULL_SYSTEM},
-            # Cache point: everything above this is cached for subsequent calls
-            {"cachePoint": {"type": "default"}},
-        ],
-        messages=messages,
-        inferenceConfig={"maxTokens": 512, "temperature": 0.1},
-    )
-
-    elapsed = time.time() - start_time
-    usage = response["usage"]
-
-    return {
-        "response": response,
-        "text": response["output"]["message"]["content"][0]["text"],
-        "latency_s": elapsed,
-        "input_tokens": usage["inputTokens"],
-        "output_tokens": usage["outputTokens"],
-        "cache_read_tokens": usage.get("cacheReadInputTokens", 0),
-        "cache_write_tokens": usage.get("cacheWriteInputTokens", 0),
-    }
-
-
-def run_cached():
+def run_cached(use_response_cache=True):
     print("=" * 70)
     print("PROMPT CACHING BENCHMARK")
     print(f"Model: {MODEL_ID}")
-    print(f"System prompt + docs: ~{len(FULL_SYSTEM.split())} words")
+    print(f"System prompt + docs: ~{SYSTEM_WORDS} words")
     print(f"Cache TTL: 5 minutes (default)")
     print("=" * 70)
 
-    total_input_tokens = 0
-    total_output_tokens = 0
-    total_cache_read = 0
-    total_cache_write = 0
-    total_latency = 0.0
-    history = []
     turn_results = []
 
-    for i, question in enumerate(QUESTIONS):
-        print(f"\n--- Turn {i + 1}/{len(QUESTIONS)} ---")
-        print(f"Q: {question}")
-
-        result = ask_question_cached(question, history)
-
-        print(f"A: {result['text'][:120]}...")
-        print(f"  Latency:            {result['latency_s']:.2f}s")
-        print(f"  Input tokens:       {result['input_tokens']}")
-        print(f"  Output tokens:      {result['output_tokens']}")
-        print(f"  Cache READ tokens:  {result['cache_read_tokens']}")
-        print(f"  Cache WRITE tokens: {result['cache_write_tokens']}")
-
-        if i == 0 and result["cache_write_tokens"] > 0:
+    for turn in iter_turns(
+        bedrock, MODEL_ID, QUESTIONS, CACHED_SYSTEM, use_response_cache=use_response_cache
+    ):
+        print(f"\n--- Turn {turn['turn']}/{len(QUESTIONS)} ---")
+        print(f"Q: {turn['question']}")
+        print(f"A: {turn['text'][:120]}...")
+        if turn["replayed"]:
+            print("  (replayed from the local response cache)")
+        print(f"  TTFT:               {turn['ttft_s']:.2f}s")
+        print(f"  Decode:             {turn['decode_s']:.2f}s ({turn['tokens_per_s']:.0f} tok/s)")
+        print(f"  Latency:            {turn['latency_s']:.2f}s")
+        if turn["summary_input_tokens"]:
+            print(f"  + summary:          {turn['summary_latency_s']:.2f}s "
+                  f"({turn['summary_input_tokens']} in / {turn['summary_output_tokens']} out, Nova Micro)")
+        print(f"  Input tokens:       {turn['input_tokens']}")
+        print(f"  Output tokens:      {turn['output_tokens']}")
+        print(f"  Cache READ tokens:  {turn['cache_read_tokens']}")
+        print(f"  Cache WRITE tokens: {turn['cache_write_tokens']}")
+
+        if turn["turn"] == 1 and turn["cache_write_tokens"] > 0:
             print(f"  ^ First call: cache WRITE (prefix stored)")
-        elif result["cache_read_tokens"] > 0:
+        elif turn["cache_read_tokens"] > 0:
             print(f"  ^ Cache HIT! Prefix read from cache")
 
-        total_input_tokens += result["input_tokens"]
-        total_output_tokens += result["output_tokens"]
-        total_cache_read += result["cache_read_tokens"]
-        total_cache_write += result["cache_write_tokens"]
-        total_latency += result["latency_s"]
-
-        turn_results.append({
-            "turn": i + 1,
-            "question": question,
-            "latency_s": result["latency_s"],
-            "input_tokens": result["input_tokens"],
-            "output_tokens": result["output_tokens"],
-            "cache_read_tokens": result["cache_read_tokens"],
-            "cache_write_tokens": result["cache_write_tokens"],
-        })
-
-        # Add to conversation history
-        history.append({"role": "user", "content": [{"text": question}]})
-        history.append({
-            "role": "assistant",
-            "content": result["response"]["output"]["message"]["content"],
-        })
+        turn_results.append({k: v for k, v in turn.items() if k != "text"})
+
+    totals = sum_turns(turn_results)
+    total_input_tokens = totals["input_tokens"]
+    total_output_tokens = totals["output_tokens"]
+    total_cache_read = totals["cache_read_tokens"]
+    total_cache_write = totals["cache_write_tokens"]
+    total_ttft = totals["ttft_s"]
+    total_decode = totals["decode_s"]
+    # Turns wait on the rolling-window summary call made before them
+    total_summary_latency = totals["summary_latency_s"]
+    total_latency = totals["latency_s"] + total_summary_latency
 
     # Load baseline for comparison
     baseline_path = Path(__file__).parent / "results_01_baseline.json"
@@ -148,43 +87,31 @@ def run_cached():
     print(f"Total output tokens:      {total_output_tokens}")
     print(f"Total cache READ tokens:  {total_cache_read}")
     print(f"Total cache WRITE tokens: {total_cache_write}")
+    print(f"Total TTFT:               {total_ttft:.2f}s")
+    print(f"Avg TTFT/turn:            {total_ttft / len(QUESTIONS):.2f}s")
+    print(f"Total decode:             {total_decode:.2f}s ({tokens_per_second(total_output_tokens, total_decode):.0f} tok/s)")
     print(f"Total latency:            {total_latency:.2f}s")
+    print(f"  incl. summary:          {total_summary_latency:.2f}s "
+          f"({totals['summary_input_tokens']} in / {totals['summary_output_tokens']} out tokens)")
     print(f"Avg latency/turn:         {total_latency / len(QUESTIONS):.2f}s")
 
     # Cost estimate
     # Nova Pro pricing: $0.80/1M input, $3.20/1M output
     # Cache read: 90% discount → $0.08/1M, Cache write: 25% premium → $1.00/1M
-    # Verify at https://aws.amazon.com/bedrock/pricing/
-    PRICING = {
-        "amazon.nova-pro-v1:0": {
-            "input": 0.80, "output": 3.20,
-            "cache_read": 0.08, "cache_write": 1.00,
-        },
-        "amazon.nova-lite-v1:0": {
-            "input": 0.06, "output": 0.24,
-            "cache_read": 0.006, "cache_write": 0.075,
-        },
-        "amazon.nova-micro-v1:0": {
-            "input": 0.035, "output": 0.14,
-            "cache_read": 0.0035, "cache_write": 0.044,
-        },
-    }
-
-    pricing = PRICING.get(MODEL_ID, PRICING["amazon.nova-pro-v1:0"])
-
-    # inputTokens from the API already represents non-cached tokens only.
-    # cacheReadInputTokens and cacheWriteInputTokens are separate counts.
-    input_cost = (total_input_tokens / 1_000_000) * pricing["input"]
-    cache_read_cost = (total_cache_read / 1_000_000) * pricing["cache_read"]
-    cache_write_cost = (total_cache_write / 1_000_000) * pricing["cache_write"]
-    output_cost = (total_output_tokens / 1_000_000) * pricing["output"]
-    total_cost = input_cost + cache_read_cost + cache_write_cost + output_cost
+    pricing = pricing_for(MODEL_ID)
+    costs = cost_breakdown(
+        MODEL_ID, total_input_tokens, total_output_tokens,
+        total_cache_read, total_cache_write,
+    )
+    total_summary_cost = summary_cost(totals)
+    total_cost = costs["total"] + total_summary_cost
 
     print(f"\n--- Cost Breakdown (this session) ---")
-    print(f"Non-cached input:  {total_input_tokens:,} tokens × ${pricing['input']}/1M = ${input_cost:.6f}")
-    print(f"Cache read:        {total_cache_read:,} tokens × ${pricing['cache_read']}/1M = ${cache_read_cost:.6f}")
-    print(f"Cache write:       {total_cache_write:,} tokens × ${pricing['cache_write']}/1M = ${cache_write_cost:.6f}")
-    print(f"Output:            {total_output_tokens:,} tokens × ${pricing['output']}/1M = ${output_cost:.6f}")
+    print(f"Non-cached input:  {total_input_tokens:,} tokens × ${pricing['input']}/1M = ${costs['input']:.6f}")
+    print(f"Cache read:        {total_cache_read:,} tokens × ${pricing['cache_read']}/1M = ${costs['cache_read']:.6f}")
+    print(f"Cache write:       {total_cache_write:,} tokens × ${pricing['cache_write']}/1M = ${costs['cache_write']:.6f}")
+    print(f"Output:            {total_output_tokens:,} tokens × ${pricing['output']}/1M = ${costs['output']:.6f}")
+    print(f"Summary calls:     {totals['summary_input_tokens']:,} in / {totals['summary_output_tokens']:,} out (Nova Micro) = ${total_summary_cost:.6f}")
     print(f"Total cost:        ${total_cost:.6f}")
 
     # Projection
@@ -204,6 +131,13 @@ def run_cached():
         monthly_savings = bl_daily["monthly_cost_usd"] - (daily_cost * 30)
 
         print(f"\n--- vs BASELINE (no caching) ---")
+        # Older baseline results were recorded before TTFT/decode were measured
+        if "ttft_s" in bl:
+            ttft_reduction = ((bl["ttft_s"] - total_ttft) / bl["ttft_s"]) * 100
+            print(f"TTFT:     {bl['ttft_s']:.2f}s → {total_ttft:.2f}s ({ttft_reduction:+.1f}%)")
+        if "decode_s" in bl:
+            decode_reduction = ((bl["decode_s"] - total_decode) / bl["decode_s"]) * 100
+            print(f"Decode:   {bl['decode_s']:.2f}s → {total_decode:.2f}s ({decode_reduction:+.1f}%)")
         print(f"Latency:  {bl['latency_s']:.2f}s → {total_latency:.2f}s ({lat_reduction:+.1f}%)")
         print(f"Cost:     ${bl['cost_usd']:.6f} → ${total_cost:.6f} ({cost_reduction:+.1f}%)")
         print(f"Monthly:  ${bl_daily['monthly_cost_usd']:.2f} → ${daily_cost * 30:.2f} (save ${monthly_savings:.2f}/mo)")
@@ -218,13 +152,17 @@ def run_cached():
             "output_tokens": total_output_tokens,
             "cache_read_tokens": total_cache_read,
             "cache_write_tokens": total_cache_write,
-            "latency_s": round(total_latency, 2),
-            "cost_usd": round(total_cost, 6),
+            "ttft_s": total_ttft,
+            "decode_s": total_decode,
+            "latency_s": total_latency,
+            "summary_latency_s": total_summary_latency,
+            "summary_cost_usd": total_summary_cost,
+            "cost_usd": total_cost,
         },
         "daily_projection": {
             "conversations": 1000,
-            "daily_cost_usd": round(daily_cost, 2),
-            "monthly_cost_usd": round(daily_cost * 30, 2),
+            "daily_cost_usd": daily_cost,
+            "monthly_cost_usd": daily_cost * 30,
         },
     }
 
@@ -235,4 +173,11 @@ def run_cached():
 
 
 if __name__ == "__main__":
-    run_cached()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always call Bedrock instead of replaying stored responses",
+    )
+    args = parser.parse_args()
+    run_cached(use_response_cache=not args.no_cache)
@@ -0,0 +1,68 @@
+"""Local SQLite cache of Bedrock responses.
+
+Re-running the benchmarks while developing sends the same prompts over and
+over; with this cache only the first run goes to Bedrock and later runs
+replay the stored responses. Use --no-cache for real measurement runs.
+"""
+
+import hashlib
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+import orjson
+
+CACHE_PATH = Path(__file__).parent / ".response_cache.sqlite3"
+
+# Only low-temperature calls are close enough to deterministic to replay
+MAX_REPLAY_TEMPERATURE = 0.1
+
+
+def _connect():
+    conn = sqlite3.connect(CACHE_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses "
+        "(key TEXT PRIMARY KEY, response BLOB, ts REAL)"
+    )
+    return conn
+
+
+def make_key(model_id, system_block, messages, inference_config, run=None):
+    """Hash everything that affects the model's answer into one cache key.
+
+    run names the benchmark configuration making the call (e.g. "routed")
+    when it isn't model_id itself, so one configuration never replays turns
+    another one measured.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_id.encode())
+    if run is not None and run != model_id:
+        digest.update(run.encode())
+    digest.update(orjson.dumps(system_block, option=orjson.OPT_SORT_KEYS))
+    digest.update(orjson.dumps(messages, option=orjson.OPT_SORT_KEYS))
+    digest.update(str(inference_config["temperature"]).encode())
+    digest.update(str(inference_config["maxTokens"]).encode())
+    return digest.hexdigest()
+
+
+def is_replayable(inference_config):
+    return inference_config["temperature"] <= MAX_REPLAY_TEMPERATURE
+
+
+def get(key):
+    """Return the stored response for key, or None on a miss."""
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+    return orjson.loads(row[0]) if row else None
+
+
+def put(key, response):
+    # A new connection per call keeps this safe to use from worker threads
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, ts) VALUES (?, ?, ?)",
+            (key, orjson.dumps(response), time.time()),
+        )
@@ -0,0 +1,328 @@
+"""Shared pieces of the benchmarks: the Bedrock client, the support-agent
+prompt and questions, pricing, and the turn loop that 01_baseline_no_cache.py
+and 02_with_prompt_caching.py both run."""
+
+import boto3
+import cache
+import functools
+import re
+import time
+from botocore.config import Config
+from pathlib import Path
+
+# One client for the whole run: keepalive + a connection pool means every
+# turn reuses the same HTTPS connection instead of paying a new TLS handshake.
+# Adaptive retries back off (with jitter) on ThrottlingException.
+# The pool is sized for the busiest caller, run_all_benchmarks.py: 6 benchmark
+# workers plus up to 3 keepalive timers (one per model) in flight at once.
+# Summary calls run on their worker's thread, so they need no extra slot.
+BEDROCK_CONFIG = Config(
+    retries={"mode": "adaptive", "max_attempts": 8},
+    tcp_keepalive=True,
+    max_pool_connections=16,
+    connect_timeout=5,
+    read_timeout=120,
+)
+
+
+@functools.lru_cache(maxsize=1)
+def get_client():
+    """Return the process-wide bedrock-runtime client."""
+    session = boto3.session.Session(region_name="us-east-1")
+    return session.client("bedrock-runtime", config=BEDROCK_CONFIG)
+
+
+SYSTEM_PROMPT = """You are a senior customer support agent for SmartWidget, a SaaS company.
+
+Rules:
+- Always be polite, professional, and concise
+- Reference the product documentation when answering
+- If the answer is not in the documentation, say so honestly
+- Format responses with bullet points for clarity
+- Never make up product features or pricing that isn't documented
+- Keep responses under 150 words unless the question requires more detail
+"""
+
+
+# Load product docs (~3000 tokens) and combine into full system content
+@functools.lru_cache(maxsize=1)
+def _load_system():
+    """Read the product docs once and return (full system text, word count)."""
+    product_docs = (Path(__file__).parent / "product_docs.txt").read_text(encoding="utf-8")
+    full_system = SYSTEM_PROMPT + "\n\n--- PRODUCT DOCUMENTATION ---\n\n" + product_docs
+    # Trailing spaces and runs of blank lines are billed as tokens but carry
+    # no meaning, so strip them before the text is sent (and cached). The
+    # bundled product_docs.txt is already tidy: this removes 7 of its ~7,550
+    # characters, so it guards edited docs rather than saving tokens today.
+    full_system = re.sub(r"[ \t]+\n", "\n", full_system.strip())
+    full_system = re.sub(r"\n{3,}", "\n\n", full_system)
+    return full_system, len(full_system.split())
+
+
+FULL_SYSTEM, SYSTEM_WORDS = _load_system()
+
+BASELINE_SYSTEM = [{"text": FULL_SYSTEM}]
+CACHED_SYSTEM = [
+    {"text": FULL_SYSTEM},
+    # Cache point: everything above this is cached for subsequent calls
+    {"cachePoint": {"type": "default"}},
+]
+
+# Realistic multi-turn customer support questions
+QUESTIONS = [
+    "What are the main features of SmartWidget Pro?",
+    "How do I configure the API integration? Give me a quick start guide.",
+    "What's the pricing for enterprise customers?",
+    "My API is returning 429 errors. How do I fix this?",
+    "How do I migrate from v3.x to v4.2? What are the breaking changes?",
+]
+
+INFERENCE_CONFIG = {"maxTokens": 512, "temperature": 0.1}
+
+# Rolling window: keep the last HISTORY_TURNS exchanges verbatim and fold
+# anything older into a summary written by a cheap model, so the part of the
+# prompt that is re-sent every turn stops growing with the conversation
+HISTORY_TURNS = 3
+SUMMARY_MODEL_ID = "amazon.nova-micro-v1:0"
+SUMMARY_PROMPT = (
+    "Summarize this customer support conversation in 80 words or fewer. "
+    "Keep product names, versions and any open issues.\n\n"
+)
+
+# Prices in USD per 1M tokens
+# Cache read: 90% discount, cache write: 25% premium
+# Verify at https://aws.amazon.com/bedrock/pricing/
+PRICING = {
+    "amazon.nova-pro-v1:0": {
+        "input": 0.80, "output": 3.20,
+        "cache_read": 0.08, "cache_write": 1.00,
+    },
+    "amazon.nova-lite-v1:0": {
+        "input": 0.06, "output": 0.24,
+        "cache_read": 0.006, "cache_write": 0.075,
+    },
+    "amazon.nova-micro-v1:0": {
+        "input": 0.035, "output": 0.14,
+        "cache_read": 0.0035, "cache_write": 0.044,
+    },
+}
+
+
+def pricing_for(model_id):
+    return PRICING.get(model_id, PRICING["amazon.nova-pro-v1:0"])
+
+
+def cost_breakdown(model_id, input_tokens, output_tokens, cache_read=0, cache_write=0):
+    """Cost in USD of each token kind, plus the total."""
+    p = pricing_for(model_id)
+    # inputTokens from the API already represents non-cached tokens only.
+    # cacheReadInputTokens and cacheWriteInputTokens are separate counts.
+    costs = {
+        "input": (input_tokens / 1e6) * p["input"],
+        "cache_read": (cache_read / 1e6) * p["cache_read"],
+        "cache_write": (cache_write / 1e6) * p["cache_write"],
+        "output": (output_tokens / 1e6) * p["output"],
+    }
+    costs["total"] = sum(costs.values())
+    return costs
+
+
+def summarize_turns(client, messages, previous_summary=None, use_response_cache=False,
+                    run=None):
+    """Fold older turns (plus any earlier summary) into a short recap.
+
+    Returns the recap text with the call's usage and latency, so the turn it
+    precedes can be charged for it. run is passed on to cache.make_key.
+    """
+    transcript = "\n".join(
+        f"{m['role'].upper()}: {m['content'][0]['text']}" for m in messages
+    )
+    if previous_summary:
+        transcript = f"EARLIER SUMMARY: {previous_summary}\n{transcript}"
+
+    request = [{"role": "user", "content": [{"text": SUMMARY_PROMPT + transcript}]}]
+    inference_config = {"maxTokens": 160, "temperature": 0.1}
+
+    key = None
+    if use_response_cache and cache.is_replayable(inference_config):
+        key = cache.make_key(SUMMARY_MODEL_ID, [], request, inference_config, run=run)
+        stored = cache.get(key)
+        # Entries stored before usage was recorded can't be priced; redo them
+        if stored is not None and "usage" in stored:
+            return stored
+
+    start = time.perf_counter()
+    response = client.converse(
+        modelId=SUMMARY_MODEL_ID,
+        messages=request,
+        inferenceConfig=inference_config,
+    )
+    result = {
+        "text": response["output"]["message"]["content"][0]["text"],
+        "usage": response["usage"],
+        "latency_s": time.perf_counter() - start,
+    }
+    if key is not None:
+        cache.put(key, result)
+    return result
+
+
+def build_messages(history, question, use_caching):
+    """History plus the new question, ready to send."""
+    messages = list(history)
+    if use_caching and messages:
+        # Second cache point at the end of the last completed turn: the whole
+        # conversation prefix is then read from cache, and only the new
+        # question is processed from scratch. The stored history is untouched.
+        last = messages[-1]
+        messages[-1] = {
+            "role": last["role"],
+            "content": last["content"] + [{"cachePoint": {"type": "default"}}],
+        }
+    messages.append({"role": "user", "content": [{"text": question}]})
+    return messages
+
+
+def with_summary(system_block, summary):
+    if not summary:
+        return list(system_block)
+    # Always after the cache point, so the cached prefix never changes
+    return list(system_block) + [{"text": f"Conversation so far (summary): {summary}"}]
+
+
+def stream_turn(client, model_id, system_block, messages, inference_config=INFERENCE_CONFIG):
+    """Send one turn with converse_stream and time it."""
+    start = time.perf_counter()
+    response = client.converse_stream(
+        modelId=model_id,
+        system=system_block,
+        messages=messages,
+        inferenceConfig=inference_config,
+    )
+
+    # Stream the reply so time-to-first-token (prefill) can be measured
+    # separately from the full response time (prefill + decode)
+    ttft = None
+    chunks = []
+    usage = {}
+    for event in response["stream"]:
+        if "contentBlockDelta" in event:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            chunks.append(event["contentBlockDelta"]["delta"].get("text", ""))
+        elif "metadata" in event:
+            usage = event["metadata"]["usage"]
+    elapsed = time.perf_counter() - start
+    if ttft is None:
+        ttft = elapsed
+
+    return {
+        "text": "".join(chunks),
+        "usage": usage,
+        "ttft_s": ttft,
+        "decode_s": elapsed - ttft,
+        "latency_s": elapsed,
+    }
+
+
+def tokens_per_second(output_tokens, decode_s):
+    """Decode throughput. Caching doesn't change it, only time-to-first-token."""
+    return output_tokens / decode_s if decode_s > 0 else 0.0
+
+
+def iter_turns(client, model_id, questions, system_block, plan=None,
+               pick_model=None, use_response_cache=False):
+    """Ask questions as one conversation, yielding a result dict per call.
+
+    A cachePoint in system_block also puts one after the last completed turn.
+    plan is a list of (prompt, question numbers), one entry per call; by
+    default every question is its own call. pick_model(call_questions) chooses
+    the model for a call from the questions in it, instead of model_id. With
+    use_response_cache, calls that were made before are replayed from the
+    local response cache.
+    """
+    use_caching = any("cachePoint" in block for block in system_block)
+    if plan is None:
+        plan = [(question, [n]) for n, question in enumerate(questions, start=1)]
+    history = []
+    summary = None
+
+    for i, (prompt, numbers) in enumerate(plan):
+        # Route on the questions themselves, not the batch prompt around them
+        turn_model = pick_model([questions[n - 1] for n in numbers]) if pick_model else model_id
+        # A batched call gets the usual output budget for every question in it
+        inference_config = dict(
+            INFERENCE_CONFIG, maxTokens=INFERENCE_CONFIG["maxTokens"] * len(numbers)
+        )
+
+        # Once the window is full, fold the oldest exchange into the summary.
+        # That call blocks this turn, so its usage and time are charged to it.
+        summary_usage = {"inputTokens": 0, "outputTokens": 0}
+        summary_latency = 0.0
+        if len(history) > HISTORY_TURNS * 2:
+            folded = summarize_turns(
+                client, history[:2], summary, use_response_cache, run=model_id
+            )
+            summary = folded["text"]
+            summary_usage = folded["usage"]
+            summary_latency = folded["latency_s"]
+            history = history[2:]
+
+        system = with_summary(system_block, summary)
+        messages = build_messages(history, prompt, use_caching)
+
+        # A replayed turn reports the timings and usage of the run that stored
+        # it; keying on model_id too keeps e.g. the routed run's turns apart
+        # from the fixed-model run that happens to pick the same tier
+        key = None
+        result = None
+        if use_response_cache and cache.is_replayable(inference_config):
+            key = cache.make_key(turn_model, system, messages, inference_config, run=model_id)
+            result = cache.get(key)
+        replayed = result is not None
+        if not replayed:
+            result = stream_turn(client, turn_model, system, messages, inference_config)
+            if key is not None:
+                cache.put(key, result)
+        usage = result["usage"]
+        # Rows stored before decode time was recorded only have TTFT and latency
+        decode = result.get("decode_s", result["latency_s"] - result["ttft_s"])
+
+        yield {
+            "turn": i + 1,
+            "model": turn_model,
+            "question": prompt,
+            "questions": numbers,
+            "text": result["text"],
+            "replayed": replayed,
+            "ttft_s": result["ttft_s"],
+            "decode_s": decode,
+            "latency_s": result["latency_s"],
+            "tokens_per_s": tokens_per_second(usage["outputTokens"], decode),
+            "input_tokens": usage["inputTokens"],
+            "output_tokens": usage["outputTokens"],
+            "cache_read_tokens": usage.get("cacheReadInputTokens", 0),
+            "cache_write_tokens": usage.get("cacheWriteInputTokens", 0),
+            # Rolling-window summary call made before this turn, if any
+            "summary_input_tokens": summary_usage["inputTokens"],
+            "summary_output_tokens": summary_usage["outputTokens"],
+            "summary_latency_s": summary_latency,
+        }
+
+        history.append({"role": "user", "content": [{"text": prompt}]})
+        history.append({"role": "assistant", "content": [{"text": result["text"]}]})
+
+
+def sum_turns(turns):
+    """Totals over the per-turn dicts yielded by iter_turns."""
+    keys = ["input_tokens", "output_tokens", "cache_read_tokens",
+            "cache_write_tokens", "ttft_s", "decode_s", "latency_s",
+            "summary_input_tokens", "summary_output_tokens", "summary_latency_s"]
+    return {key: sum(turn[key] for turn in turns) for key in keys}
+
+
+def summary_cost(totals):
+    """Cost in USD of the rolling-window summary calls in totals."""
+    return cost_breakdown(
+        SUMMARY_MODEL_ID, totals["summary_input_tokens"], totals["summary_output_tokens"]
+    )["total"]
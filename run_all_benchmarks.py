@@ -1,181 +1,385 @@
 """Runs every Nova model (Pro, Lite, Micro) with and without caching
-and prints a comparison table at the end. Takes ~2 minutes total."""
-
-import boto3
-import json
-import time
+and prints a comparison table at the end. The runs are dispatched in
+parallel, so this takes roughly as long as the slowest model (plus the
+routed pair, which runs last, with --route)."""
+
+import argparse
+import orjson
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
-bedrock = boto3.client("bedrock-runtime", region_name="us-east-1")
-
-SYSTEM_PROMPT = """You are a senior customer support agent for SmartWidget, a SaaS company.
-
-Rules:
-- Always be polite, professional, and concise
-- Reference the product documentation when answering
-- If the answer is not in the documentation, say so honestly
-- Format responses with bullet points for clarity
-- Never make up product features or pricing that isn't documented
-- Keep responses under 150 words unless the question requires more detail
-"""
-
-PRODUCT_DOCS = Path(__file__).parent.joinpath("product_docs.txt").read_text()
-FULL_SYSTEM = SYSTEM_PROMPT + "\n\n--- PRODUCT DOCUMENTATION ---\n\n" + PRODUCT_DOCS
-
-QUESTIONS = [
-    "What are the main features of SmartWidget Pro?",
-    "How do I configure the API integration? Give me a quick start guide.",
-    "What's the pricing for enterprise customers?",
-    "My API is returning 429 errors. How do I fix this?",
-    "How do I migrate from v3.x to v4.2? What are the breaking changes?",
+from common import (
+    BASELINE_SYSTEM,
+    CACHED_SYSTEM,
+    QUESTIONS,
+    cost_breakdown,
+    get_client,
+    iter_turns,
+    sum_turns,
+    summary_cost,
+    tokens_per_second,
+)
+
+# One worker per (model, mode) pair. Plain threads on one shared client are
+# enough here: each worker keeps its own warm keepalive connection from the
+# pool (sized for these workers in common.BEDROCK_CONFIG), so an
+# asyncio/HTTP2 rewrite would not remove any handshakes.
+MAX_WORKERS = 6
+
+# A stand-alone FAQ lookup is a What/Which question with no how-to, migration
+# or back-reference phrasing (see is_faq), e.g. features or pricing. With
+# --batch these are answered together in a single call.
+FAQ_LOOKUP = re.compile(r"^\s*(what|which)\b", re.IGNORECASE)
+BACK_REFERENCE = re.compile(r"\b(above|previous|earlier|again|you said|mentioned)\b", re.IGNORECASE)
+BATCH_PROMPT = (
+    "Answer each numbered question separately. Start each answer on its own "
+    'line with "Answer N:", where N is the question number.\n\n'
+)
+
+# Bedrock's default cache TTL is 5 minutes. A model whose cached prefix has
+# been idle this long gets a 1-token request that re-reads (and so refreshes)
+# it, so a long pipeline doesn't pay the cache-write premium twice. Each model
+# gets at most CACHE_KEEPALIVE_MAX of these, and none once its runs are done.
+CACHE_KEEPALIVE_AFTER_S = 240
+CACHE_KEEPALIVE_MAX = 3
+
+MODELS = [
+    ("amazon.nova-pro-v1:0", "Nova Pro"),
+    ("amazon.nova-lite-v1:0", "Nova Lite"),
+    ("amazon.nova-micro-v1:0", "Nova Micro"),
 ]
 
-PRICING = {
-    "amazon.nova-pro-v1:0": {
-        "input": 0.80, "output": 3.20,
-        "cache_read": 0.08, "cache_write": 1.00,
-    },
-    "amazon.nova-lite-v1:0": {
-        "input": 0.06, "output": 0.24,
-        "cache_read": 0.006, "cache_write": 0.075,
-    },
-    "amazon.nova-micro-v1:0": {
-        "input": 0.035, "output": 0.14,
-        "cache_read": 0.0035, "cache_write": 0.044,
-    },
-}
-
-
-def run_benchmark(model_id, use_caching):
-    """Run a 5-turn conversation benchmark."""
-    label = f"{'CACHED' if use_caching else 'BASELINE'}"
-    history = []
-    turns = []
-    total_input = 0
-    total_output = 0
-    total_cache_read = 0
-    total_cache_write = 0
-    total_latency = 0.0
-
-    for i, question in enumerate(QUESTIONS):
-        messages = history + [{"role": "user", "content": [{"text": question}]}]
-
-        if use_caching:
-            system_block = [
-                {"text": FULL_SYSTEM},
-                {"cachePoint": {"type": "default"}},
-            ]
-        else:
-            system_block = [{"text": FULL_SYSTEM}]
-
-        start = time.time()
-        response = bedrock.converse(
+# With --route, the "Routed" configuration picks a tier per question instead
+# of using one model for the whole conversation
+ROUTED = "routed"
+NEEDS_PRO = re.compile(r"\b(migrat\w*|breaking|upgrade)\b|\bv?\d+\.\d+", re.IGNORECASE)
+NEEDS_LITE = re.compile(r"\b(how do i|fix|error|errors|configure|debug)\b", re.IGNORECASE)
+
+# Benchmarks run on worker threads; keep their output lines from interleaving
+print_lock = threading.Lock()
+
+
+def log(message):
+    with print_lock:
+        print(message)
+
+
+# Keepalive state per model_id, shared by the benchmark workers and timers
+keepalive_timers = {}
+keepalive_stopped = set()
+keepalive_counts = {}
+keepalive_costs = {}
+keepalive_lock = threading.Lock()
+
+
+def schedule_keepalive(client, model_id, system_block):
+    """(Re)start the idle timer that keeps model_id's cached prefix warm."""
+    timer = threading.Timer(
+        CACHE_KEEPALIVE_AFTER_S, send_keepalive, args=(client, model_id, system_block)
+    )
+    timer.daemon = True
+    with keepalive_lock:
+        # Checked under the lock so a stopped model never gets a new timer
+        if model_id in keepalive_stopped:
+            return
+        if keepalive_counts.get(model_id, 0) >= CACHE_KEEPALIVE_MAX:
+            return
+        previous = keepalive_timers.get(model_id)
+        if previous is not None:
+            previous.cancel()
+        keepalive_timers[model_id] = timer
+        timer.start()
+
+
+def send_keepalive(client, model_id, system_block):
+    with keepalive_lock:
+        if model_id in keepalive_stopped:
+            return
+        keepalive_counts[model_id] = keepalive_counts.get(model_id, 0) + 1
+    try:
+        response = client.converse(
             modelId=model_id,
             system=system_block,
-            messages=messages,
-            inferenceConfig={"maxTokens": 512, "temperature": 0.1},
+            messages=[{"role": "user", "content": [{"text": "ok"}]}],
+            inferenceConfig={"maxTokens": 1},
         )
-        elapsed = time.time() - start
-
-        usage = response["usage"]
-        cr = usage.get("cacheReadInputTokens", 0)
-        cw = usage.get("cacheWriteInputTokens", 0)
-
-        turns.append({
-            "turn": i + 1,
-            "latency_s": elapsed,
-            "input_tokens": usage["inputTokens"],
-            "output_tokens": usage["outputTokens"],
-            "cache_read": cr,
-            "cache_write": cw,
-        })
-
-        total_input += usage["inputTokens"]
-        total_output += usage["outputTokens"]
-        total_cache_read += cr
-        total_cache_write += cw
-        total_latency += elapsed
-
-        history.append({"role": "user", "content": [{"text": question}]})
-        history.append({
-            "role": "assistant",
-            "content": response["output"]["message"]["content"],
-        })
+    except Exception as e:
+        log(f"  [{model_id}] cache keepalive failed — {str(e)[:100]}")
+        return
+    usage = response["usage"]
+    cost = cost_breakdown(
+        model_id,
+        usage["inputTokens"],
+        usage["outputTokens"],
+        usage.get("cacheReadInputTokens", 0),
+        usage.get("cacheWriteInputTokens", 0),
+    )["total"]
+    with keepalive_lock:
+        keepalive_costs[model_id] = keepalive_costs.get(model_id, 0.0) + cost
+    log(f"  [{model_id}] cache keepalive sent (${cost:.6f})")
+    schedule_keepalive(client, model_id, system_block)
+
+
+def stop_keepalive(model_id):
+    """Stop keeping model_id warm, waiting for a keepalive already in flight."""
+    with keepalive_lock:
+        keepalive_stopped.add(model_id)
+        timer = keepalive_timers.pop(model_id, None)
+    if timer is not None:
+        timer.cancel()
+        timer.join()
+
+
+def cancel_keepalives():
+    with keepalive_lock:
+        model_ids = list(keepalive_timers)
+    for model_id in model_ids:
+        stop_keepalive(model_id)
+
+
+def route(question):
+    """Pick the cheapest Nova tier that should handle this question well."""
+    if NEEDS_PRO.search(question):
+        return "amazon.nova-pro-v1:0"
+    if NEEDS_LITE.search(question):
+        return "amazon.nova-lite-v1:0"
+    # Plain FAQ lookups (features, pricing) are answered straight from the docs
+    return "amazon.nova-micro-v1:0"
+
+
+def route_call(questions):
+    """Route a call to the tier its most demanding question needs."""
+    # MODELS is ordered from most to least capable
+    tiers = [model_id for model_id, _ in MODELS]
+    return min((route(question) for question in questions), key=tiers.index)
+
+
+def is_faq(question):
+    """True for a plain documentation lookup that needs no earlier turns."""
+    return bool(
+        FAQ_LOOKUP.search(question)
+        and not BACK_REFERENCE.search(question)
+        and not NEEDS_PRO.search(question)
+        and not NEEDS_LITE.search(question)
+    )
+
+
+def plan_turns(batch_independent):
+    """Return (prompt, question numbers) for each call the benchmark makes."""
+    numbered = list(enumerate(QUESTIONS, start=1))
+    if not batch_independent:
+        return [(question, [n]) for n, question in numbered]
+
+    independent = [(n, q) for n, q in numbered if is_faq(q)]
+    if len(independent) < 2:
+        return [(question, [n]) for n, question in numbered]
+
+    # The batch goes first so later, dependent turns can build on its answers
+    batch = BATCH_PROMPT + "\n".join(
+        f"{i}. {question}" for i, (_, question) in enumerate(independent, start=1)
+    )
+    plan = [(batch, [n for n, _ in independent])]
+    plan += [(q, [n]) for n, q in numbered if not is_faq(q)]
+    return plan
+
+
+def split_numbered_answers(text, count):
+    """Split an "Answer 1: ... Answer 2: ..." reply, or None if it doesn't parse."""
+    parts = re.split(r"(?m)^\s*\**Answer (\d+):\**\s*", text)
+    answers = {}
+    for number, answer in zip(parts[1::2], parts[2::2]):
+        answers.setdefault(int(number), answer.strip())
+    if sorted(answers) != list(range(1, count + 1)):
+        return None
+    return [answers[n] for n in range(1, count + 1)]
+
+
+def run_benchmark(client, model_id, use_caching, use_response_cache=True,
+                  batch_independent=False):
+    """Run a 5-turn conversation benchmark."""
+    label = f"{'CACHED' if use_caching else 'BASELINE'}"
+    system_block = CACHED_SYSTEM if use_caching else BASELINE_SYSTEM
+    turns = []
+    cost = 0.0
+
+    for turn in iter_turns(
+        client,
+        model_id,
+        QUESTIONS,
+        system_block,
+        plan=plan_turns(batch_independent),
+        pick_model=route_call if model_id == ROUTED else None,
+        use_response_cache=use_response_cache,
+    ):
+        turn_model = turn["model"]
+        numbers = turn["questions"]
+        cr = turn["cache_read_tokens"]
+        cw = turn["cache_write_tokens"]
+
+        if use_caching and not turn["replayed"]:
+            # Only the stable prefix up to the system cache point
+            schedule_keepalive(client, turn_model, CACHED_SYSTEM)
+
+        # Priced per turn, since a routed run mixes tiers
+        cost += cost_breakdown(
+            turn_model, turn["input_tokens"], turn["output_tokens"], cr, cw
+        )["total"]
 
         cache_status = ""
         if use_caching:
             cache_status = f" | cache_r={cr} cache_w={cw}"
-        print(f"  Turn {i+1}: {elapsed:.2f}s | in={usage['inputTokens']} out={usage['outputTokens']}{cache_status}")
-
-    # Calculate cost
-    p = PRICING.get(model_id, PRICING["amazon.nova-pro-v1:0"])
-    if use_caching:
-        # inputTokens from API already represents non-cached tokens only
-        cost = (
-            (total_input / 1e6) * p["input"]
-            + (total_cache_read / 1e6) * p["cache_read"]
-            + (total_cache_write / 1e6) * p["cache_write"]
-            + (total_output / 1e6) * p["output"]
-        )
-    else:
-        cost = (
-            (total_input / 1e6) * p["input"]
-            + (total_output / 1e6) * p["output"]
-        )
-
+        if turn["replayed"]:
+            cache_status += " | replayed"
+        if model_id == ROUTED:
+            cache_status += f" | tier={dict(MODELS)[turn_model]}"
+        if turn["summary_input_tokens"]:
+            cache_status += (f" | +summary {turn['summary_latency_s']:.2f}s "
+                             f"in={turn['summary_input_tokens']} out={turn['summary_output_tokens']}")
+        record = {k: v for k, v in turn.items() if k not in ("text", "question")}
+        if len(numbers) > 1:
+            cache_status += f" | batched Q{','.join(map(str, numbers))}"
+            # One answer per entry in "questions", or None if it didn't parse
+            record["answers"] = split_numbered_answers(turn["text"], len(numbers))
+            if record["answers"] is None:
+                cache_status += " (reply not numbered as asked)"
+        log(f"  [{model_id} {label}] Turn {turn['turn']}: ttft={turn['ttft_s']:.2f}s decode={turn['decode_s']:.2f}s "
+            f"total={turn['latency_s']:.2f}s | in={turn['input_tokens']} out={turn['output_tokens']}{cache_status}")
+
+        turns.append(record)
+
+    totals = sum_turns(turns)
+    # The rolling-window summary calls are on the critical path and billed too
+    cost += summary_cost(totals)
+    total_latency = totals["latency_s"] + totals["summary_latency_s"]
     return {
         "model": model_id,
         "caching": use_caching,
         "turns": turns,
-        "total_input": total_input,
-        "total_output": total_output,
-        "total_cache_read": total_cache_read,
-        "total_cache_write": total_cache_write,
-        "total_latency": round(total_latency, 2),
-        "avg_latency": round(total_latency / len(QUESTIONS), 2),
-        "cost": round(cost, 6),
-        "monthly_cost": round(cost * 1000 * 30, 2),
+        "total_input": totals["input_tokens"],
+        "total_output": totals["output_tokens"],
+        "total_cache_read": totals["cache_read_tokens"],
+        "total_cache_write": totals["cache_write_tokens"],
+        "total_ttft": totals["ttft_s"],
+        # Per call made, which --batch makes fewer of than there are questions
+        "avg_ttft": totals["ttft_s"] / len(turns),
+        "total_decode": totals["decode_s"],
+        "tokens_per_s": tokens_per_second(totals["output_tokens"], totals["decode_s"]),
+        "total_summary_latency": totals["summary_latency_s"],
+        "total_latency": total_latency,
+        "avg_latency": total_latency / len(turns),
+        "cost": cost,
+        "monthly_cost": cost * 1000 * 30,
     }
 
 
 def main():
-    models = [
-        ("amazon.nova-pro-v1:0", "Nova Pro"),
-        ("amazon.nova-lite-v1:0", "Nova Lite"),
-        ("amazon.nova-micro-v1:0", "Nova Micro"),
-    ]
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always call Bedrock instead of replaying stored responses",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="answer stand-alone FAQ questions together in one call",
+    )
+    parser.add_argument(
+        "--route",
+        action="store_true",
+        help="also run a configuration that routes each question to a Nova tier",
+    )
+    args = parser.parse_args()
+    options = {"use_response_cache": not args.no_cache, "batch_independent": args.batch}
+
+    bedrock = get_client()
+
+    models = list(MODELS)
+    if args.route:
+        models.append((ROUTED, "Routed"))
 
     all_results = {}
 
-    for model_id, name in models:
-        for use_caching in [False, True]:
-            mode = "cached" if use_caching else "baseline"
-            key = f"{name}_{mode}"
-            print(f"\n{'='*60}")
-            print(f"  {name} — {'WITH CACHING' if use_caching else 'NO CACHING'}")
-            print(f"{'='*60}")
-
-            try:
-                result = run_benchmark(model_id, use_caching)
-                all_results[key] = result
-                print(f"  TOTAL: {result['total_latency']}s | ${result['cost']:.6f} | "
-                      f"monthly=${result['monthly_cost']}")
-            except Exception as e:
-                print(f"  SKIPPED — {str(e)[:100]}")
-
-            # Small delay between benchmarks to avoid throttling
-            time.sleep(2)
+    # Cached runs still to come that read each model's prefix. Once a model
+    # has none left, keeping its prefix warm would only cost money.
+    prefix_users = {model_id: 1 for model_id, _ in MODELS}
+    if args.route:
+        for model_id in prefix_users:
+            prefix_users[model_id] += 1
+
+    # Every (model, mode) run is independent network I/O, so they overlap.
+    # A model's cached run is only submitted once its baseline has finished.
+    # The routed pair sends the same cached prefixes to the same models, so it
+    # only starts once every fixed-model cached run is done; otherwise which
+    # run paid each model's cache write would depend on timing.
+    fixed_cached_left = len(MODELS)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pending = {
+            executor.submit(run_benchmark, bedrock, model_id, False, **options): (model_id, name, False)
+            for model_id, name in MODELS
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                model_id, name, use_caching = pending.pop(future)
+                mode = "cached" if use_caching else "baseline"
+                key = f"{name}_{mode}"
+
+                try:
+                    result = future.result()
+                    all_results[key] = result
+                    log(f"  {name} — {'WITH CACHING' if use_caching else 'NO CACHING'} "
+                        f"TOTAL: ttft={result['total_ttft']:.2f}s latency={result['total_latency']:.2f}s | "
+                        f"${result['cost']:.6f} | monthly=${result['monthly_cost']:.2f}")
+                except Exception as e:
+                    log(f"  {name} — {mode} SKIPPED — {str(e)[:100]}")
+
+                if not use_caching:
+                    future = executor.submit(run_benchmark, bedrock, model_id, True, **options)
+                    pending[future] = (model_id, name, True)
+                    continue
+
+                for used in (prefix_users if model_id == ROUTED else [model_id]):
+                    prefix_users[used] -= 1
+                    if prefix_users[used] == 0:
+                        stop_keepalive(used)
+
+                if model_id != ROUTED:
+                    fixed_cached_left -= 1
+                    if fixed_cached_left == 0 and args.route:
+                        future = executor.submit(run_benchmark, bedrock, ROUTED, False, **options)
+                        pending[future] = (ROUTED, "Routed", False)
+
+    cancel_keepalives()
+
+    # Keepalives are charged to the cached run of the model they refreshed
+    for model_id, name in MODELS:
+        key = f"{name}_cached"
+        if key not in all_results:
+            continue
+        r = all_results[key]
+        r["keepalives"] = keepalive_counts.get(model_id, 0)
+        r["keepalive_cost"] = keepalive_costs.get(model_id, 0.0)
+        r["cost"] += r["keepalive_cost"]
+        r["monthly_cost"] = r["cost"] * 1000 * 30
 
     # Print comparison table
     print(f"\n\n{'='*80}")
     print("FULL COMPARISON TABLE")
     print(f"{'='*80}")
-    print(f"{'Config':<35} {'Latency':>8} {'Input Tok':>10} {'Cache R':>8} {'Cost':>10} {'Monthly':>10}")
+    print(f"{'Config':<26} {'TTFT':>8} {'Latency':>8} {'Input Tok':>10} {'Cache R':>8} {'Cost':>10} {'Monthly':>10}")
     print("-" * 80)
 
-    for key, r in all_results.items():
-        print(f"{key:<35} {r['total_latency']:>7.2f}s {r['total_input']:>10,} "
-              f"{r['total_cache_read']:>8,} ${r['cost']:>9.6f} ${r['monthly_cost']:>9.2f}")
+    for model_id, name in models:
+        for mode in ("baseline", "cached"):
+            key = f"{name}_{mode}"
+            if key not in all_results:
+                continue
+            r = all_results[key]
+            print(f"{key:<26} {r['total_ttft']:>7.2f}s {r['total_latency']:>7.2f}s {r['total_input']:>10,} "
+                  f"{r['total_cache_read']:>8,} ${r['cost']:>9.6f} ${r['monthly_cost']:>9.2f}")
 
     # Calculate improvements
     print(f"\n{'='*80}")
@@ -186,19 +390,23 @@ def main():
         bl = all_results[f"{name}_baseline"]
         ca = all_results[f"{name}_cached"]
 
+        ttft_imp = ((bl["total_ttft"] - ca["total_ttft"]) / bl["total_ttft"]) * 100
+        decode_imp = ((bl["total_decode"] - ca["total_decode"]) / bl["total_decode"]) * 100
         lat_imp = ((bl["total_latency"] - ca["total_latency"]) / bl["total_latency"]) * 100
         cost_imp = ((bl["cost"] - ca["cost"]) / bl["cost"]) * 100
         monthly_save = bl["monthly_cost"] - ca["monthly_cost"]
 
         print(f"\n{name}:")
-        print(f"  Latency:  {bl['total_latency']}s → {ca['total_latency']}s ({lat_imp:+.1f}%)")
+        print(f"  TTFT:     {bl['total_ttft']:.2f}s → {ca['total_ttft']:.2f}s ({ttft_imp:+.1f}%)")
+        print(f"  Decode:   {bl['total_decode']:.2f}s → {ca['total_decode']:.2f}s ({decode_imp:+.1f}%) | "
+              f"{bl['tokens_per_s']:.0f} → {ca['tokens_per_s']:.0f} tok/s")
+        print(f"  Latency:  {bl['total_latency']:.2f}s → {ca['total_latency']:.2f}s ({lat_imp:+.1f}%)")
         print(f"  Cost:     ${bl['cost']:.6f} → ${ca['cost']:.6f} ({cost_imp:+.1f}%)")
         print(f"  Monthly:  ${bl['monthly_cost']:.2f} → ${ca['monthly_cost']:.2f} (save ${monthly_save:.2f}/mo)")
 
     # Save all results
     output_path = Path(__file__).parent / "results_full_comparison.json"
-    with open(output_path, "w") as f:
-        json.dump(all_results, f, indent=2, default=str)
+    output_path.write_bytes(orjson.dumps(all_results, option=orjson.OPT_INDENT_2))
     print(f"\nResults saved to: {output_path}")
 
 